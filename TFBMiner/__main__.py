@@ -2,14 +2,14 @@
 Conducts the software execution.
 """
 
+import importlib.util
 import time
 import sys
-import glob
 import os
 
 import pandas as pd
 
-from TFBMiner import interface, identify_metabolizers, process_metabolizers
+from TFBMiner import interface, acquire_data, identify_metabolizers, process_metabolizers
 
 
 _ROOT = os.path.abspath(os.path.dirname(__file__))
@@ -25,7 +25,11 @@ def main():
     single_gene_operons = args.single_gene_operons 
     genome_files_path = args.genome_files_path
     output_path = args.output_path
+    output_format = args.output_format
+    acquire_data.set_options({"refresh_cache": args.refresh_cache == "y", "timeout": args.kegg_timeout})
 
+    if output_format != "csv" and importlib.util.find_spec("pyarrow") is None:
+        sys.exit(f"Error: pyarrow is required to output {output_format} files.")
     if max_chain_length < 2:
         sys.exit("Error: chains cannot be less than 2 enzymes in length.")
     if max_chain_length > 5:
@@ -43,29 +47,24 @@ def main():
 
     if not os.path.isdir(genome_files_path):
         sys.exit(f"Error: {genome_files_path} was not found.")
-    if not os.listdir(genome_files_path):
+    # The genome files are listed once, in a single pass over the directory.
+    with os.scandir(genome_files_path) as entries:
+        genome_files = [entry.path for entry in entries if entry.is_file()]
+    if not genome_files:
         sys.exit(f"Error: {genome_files_path} is empty.")
-    else:
-        genome_files = glob.glob(genome_files_path+"\*")
-        if len(genome_files)==0:
-            genome_files = glob.glob(genome_files_path+"*")
-        if len(genome_files)==0:
-            genome_files = glob.glob(genome_files_path+"/*")
-        genome_assemblies_path = get_path("genome_assemblies.csv")
+    genome_assemblies_path = get_path("genome_assemblies.csv")
     try:
-        genome_assemblies = pd.read_csv(genome_assemblies_path)
-        genome_assemblies.drop(columns=genome_assemblies.columns[0], 
-            axis=1, 
-            inplace=True)
+        # Only the columns used to locate genomes are parsed.
+        genome_assemblies = pd.read_csv(genome_assemblies_path, usecols=["Organism code", "Assembly"])
     except FileNotFoundError:
         sys.exit(f"Error: {genome_assemblies_path} was not found.")
     
     if single_gene_operons != "y":
         chains, total_chains = identify_metabolizers.MetabolizerIdentifier(inducer).execute_chain_identification(max_chain_length)
-        process_metabolizers.MetabolizerProcessor(inducer, genome_assemblies, genome_files, t1, output_path, chains, total_chains).process_chains()
+        process_metabolizers.MetabolizerProcessor(inducer, genome_assemblies, genome_files, t1, output_path, chains, total_chains, output_format).process_chains()
     else:
         enzymes, total_enzymes = identify_metabolizers.MetabolizerIdentifier(inducer).execute_single_metabolizer_identification()
-        process_metabolizers.MetabolizerProcessor(inducer, genome_assemblies, genome_files, t1, output_path, enzymes, total_enzymes).process_single_metabolizers()
+        process_metabolizers.MetabolizerProcessor(inducer, genome_assemblies, genome_files, t1, output_path, enzymes, total_enzymes, output_format).process_single_metabolizers()
         
 
 if __name__ == "__main__":
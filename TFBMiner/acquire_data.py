@@ -1,35 +1,221 @@
-from urllib.error import HTTPError
-from urllib.request import urlopen
+import concurrent.futures
+import functools
+import threading
+import sqlite3
 import time
-import io
+import zlib
+import os
+import re
+
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from tqdm import tqdm
+import requests
+
+
+# KEGG database entries are stored on disk once retrieved so that
+# repeated retrievals, including those of later runs, skip the RESTful API.
+_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".kegg_cache.sqlite")
+_cache_connections = threading.local()
+# Threads that concurrently retrieve KEGG database entries. Kept small
+# to avoid overloading the RESTful API, and divided between worker 
+# processes through the "fetch_threads" option.
+_FETCH_THREADS = 8
+_options = {"refresh_cache": False, "timeout": 30, "fetch_threads": _FETCH_THREADS}
+_fetch_executor = None
+_fetch_executor_pid = None
+_session = None
+_session_pid = None
+# The time after which uncached entries are no longer retrieved, if any.
+_deadline = None
+# Matches lines of KEGG database entries that begin a section,
+# capturing the name of the section and the data held on the line.
+_SECTION_RX = re.compile(r"^(\S{1,12})\s*(.*)$")
+
+
+def set_options(options):
+    """
+    Sets the options that control how KEGG database entries are retrieved.
+    Also serves as a process pool initializer so that worker processes
+    retrieve entries in the same manner as the main process.
+    """
+    _options.update(options)
+
+
+def get_options():
+    """
+    Returns the options that control how KEGG database entries are retrieved.
+    """
+    return dict(_options)
+
+
+def set_deadline(seconds):
+    """
+    Limits the time spent retrieving uncached KEGG database entries to the given 
+    number of seconds from now, after which they are treated as unavailable. 
+    A limit of None allows retrievals to continue indefinitely.
+    """
+    global _deadline
+    _deadline = None if seconds is None else time.monotonic() + seconds
+
+
+class _EntryUnavailable(Exception):
+    """
+    Raised within memoized functions when a KEGG database entry 
+    could not be retrieved, so that the failure is not memoized.
+    """
+
+
+def _memoize(unavailable):
+    """
+    Memoizes a function of a KEGG ID with functools.lru_cache. Calls for which the
+    entry is unavailable return the given value without being memoized, so that
+    the entry can be retrieved again later.
+    """
+    def decorator(function):
+        memoized_function = functools.lru_cache(maxsize=None)(function)
+
+        @functools.wraps(function)
+        def wrapper(term):
+            try:
+                return memoized_function(term)
+            except _EntryUnavailable:
+                return unavailable
+
+        wrapper.cache_clear = memoized_function.cache_clear
+        return wrapper
+
+    return decorator
+
+
+def _cache_connection():
+    """
+    Opens, or reuses, the connection of the current thread to the
+    on-disk cache of KEGG database entries.
+    """
+    # Connections cannot be shared between threads, nor
+    # inherited by processes that are forked from this one.
+    connection = getattr(_cache_connections, "connection", None)
+    if (connection is None) or (_cache_connections.pid != os.getpid()):
+        connection = sqlite3.connect(_CACHE_PATH, timeout=60)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("CREATE TABLE IF NOT EXISTS entries (term TEXT PRIMARY KEY, body BLOB, ts INTEGER)")
+        _cache_connections.connection = connection
+        _cache_connections.pid = os.getpid()
+    return connection
+
+
+def _read_cache(key):
+    """
+    Returns a cached KEGG database entry, or None if it has not been cached.
+    """
+    try:
+        row = _cache_connection().execute("SELECT body FROM entries WHERE term = ?", (key,)).fetchone()
+    except sqlite3.Error:
+        return None
+    if row is not None:
+        return zlib.decompress(row[0]).decode("UTF-8")
+
+
+def _write_cache(key, data):
+    """
+    Stores a compressed KEGG database entry in the on-disk cache.
+    """
+    try:
+        with _cache_connection() as connection:
+            connection.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?)",
+                (key, zlib.compress(data.encode("UTF-8")), int(time.time())))
+    except sqlite3.Error:
+        # The retrieval is unaffected if the cache cannot be written to.
+        pass
+
+
+def _kegg_session():
+    """
+    Returns a session that keeps connections to KEGG's RESTful API alive between
+    retrievals and retries those that are blocked, respecting any Retry-After header.
+    """
+    global _session, _session_pid
+    # Pooled connections must not be shared with processes forked from this one.
+    if (_session is None) or (_session_pid != os.getpid()):
+        retries = Retry(total=5, 
+            backoff_factor=2, 
+            status_forcelist=[403, 429, 500, 502, 503, 504], 
+            respect_retry_after_header=True,
+            raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=retries)
+        _session = requests.Session()
+        _session.mount("http://", adapter)
+        _session.mount("https://", adapter)
+        _session_pid = os.getpid()
+    return _session
 
 
 def get_data(search_term):
     """
-    Retrieves data held in KEGG database entries using KEGG's RESTful API.
+    Retrieves data held in KEGG database entries using KEGG's RESTful API,
+    or from the on-disk cache if the entry has been retrieved before.
+    The data is returned as a list of lines, split once for all parsers,
+    which is empty if the entry does not exist. None is returned if the
+    entry could not be retrieved.
     """
     URL = "http://rest.kegg.jp/get/%s"
+    # The full URL is used as the cache key so that
+    # entries are not reused if the API changes.
+    url = URL % search_term
+    if not _options["refresh_cache"]:
+        data = _read_cache(url)
+        if data is not None:
+            return data.rstrip().splitlines()
+    # Entries are not retrieved once the time limit has passed, to 
+    # avoid stalling on a slow or rate-limited RESTful API.
+    if (_deadline is not None) and (time.monotonic() > _deadline):
+        return None
     
     try:
         # Constructs and uses a querystring for the RESTful URL to
         # retrieve HTML data for the relevant KEGG database entry.
-        data = urlopen(URL % search_term)
-        data = io.TextIOWrapper(data, encoding="UTF-8").read()
-        return data
-    
-    except HTTPError:
-        # Tries again after 10s if access is blocked.
-        # This prevents the program from overloading the RESTful API.
-        time.sleep(10)
-        try:
-            data = urlopen(URL % search_term)
-            data = io.TextIOWrapper(data, encoding="UTF-8").read()
-            return data
+        response = _kegg_session().get(url, timeout=(5, _options["timeout"]))
+    except requests.RequestException:
+        return None
+    if response.status_code == 404:
+        # Entries that do not exist, such as those of glycans, are 
+        # stored as empty so that they are not requested again.
+        data = ""
+    elif response.status_code != 200:
+        # Other failures, such as blocked or rate-limited 
+        # requests, may succeed if retried later.
+        return None
+    else:
+        response.encoding = "UTF-8"
+        data = response.text
 
-        except HTTPError:
-            return None
+    _write_cache(url, data)
+    return data.rstrip().splitlines()
 
 
+def prefetch(function, terms, progress=False):
+    """
+    Concurrently applies a memoized retrieval function to several KEGG IDs so that
+    their network latencies overlap. Returns the results in the order of the IDs.
+    A progress bar of the retrievals is displayed if progress is True.
+    """
+    global _fetch_executor, _fetch_executor_pid
+    # Threads are not inherited by processes that are forked
+    # from this one, so each process creates its own executor.
+    if (_fetch_executor is None) or (_fetch_executor_pid != os.getpid()):
+        _fetch_executor = concurrent.futures.ThreadPoolExecutor(max_workers=_options["fetch_threads"])
+        _fetch_executor_pid = os.getpid()
+    # Repeated IDs are only retrieved once.
+    unique_terms = list(dict.fromkeys(terms))
+    retrieved = _fetch_executor.map(function, unique_terms)
+    if progress:
+        retrieved = tqdm(retrieved, total=len(unique_terms))
+    results = dict(zip(unique_terms, retrieved))
+    return [results[term] for term in terms]
+
+
+@_memoize(unavailable=[])
 def identify_reactions(compound):
     """
     Extracts the KEGG IDs of all reactions that a compound is 
@@ -41,36 +227,32 @@ def identify_reactions(compound):
     search_term = "cpd:" + str(compound)
     data = get_data(search_term)
     if data is None:
-        return []
+        raise _EntryUnavailable
     else:
-        try:
-            # Retrieved HTML data is read line by line.
-            current_section = None
-            for line in data.rstrip().split("\n"):
-                section = line[:12].strip()
-                if not section == "":
-                    current_section = section
-                    # Finds section where reactions are listed
-                    # and extracts their IDs from each line.
-                    if current_section == "REACTION":
-                        index = data.rstrip().split("\n").index(line)
-                        reactions = line[12:].split(" ")
-                        for line in data.rstrip().split("\n")[int(index)+1:]:
-                            # If the current line is not part of the REACTION 
-                            # section then the processing ends.
-                            if line[:12].strip() != (""):
-                                break
-                            reactions_ = line[12:].split(" ")
-                            reactions.extend(reactions_)
-            # Eliminates erroneous IDs resulting from whitespaces.
-            reactions = ['rn:' + reaction for reaction in reactions if reaction != ""]
-            
-            return reactions
+        # Retrieved HTML data is read line by line.
+        reactions = []
+        current_section = None
+        for line in data:
+            match = _SECTION_RX.match(line)
+            if match is not None:
+                # If the REACTION section has been read
+                # then the processing ends.
+                if current_section == "REACTION":
+                    break
+                current_section, content = match.groups()
+            else:
+                content = line[12:]
+            # Finds section where reactions are listed
+            # and extracts their IDs from each line.
+            if current_section == "REACTION":
+                reactions.extend(content.split(" "))
+        # Eliminates erroneous IDs resulting from whitespaces.
+        reactions = ['rn:' + reaction for reaction in reactions if reaction != ""]
 
-        except UnboundLocalError:
-            return []
+        return reactions
 
 
+@_memoize(unavailable=(None,)*3)
 def reaction_details(reaction):
     """
     Identifies EC numbers of the enzymes that catalyse a reaction, along with
@@ -78,20 +260,20 @@ def reaction_details(reaction):
     """
     data = get_data(reaction)
     if data is None:
-        return (None,)*3
+        raise _EntryUnavailable
     else:
         try:
             # Retrieved HTML data is read line by line.
             current_section = None
-            for line in data.rstrip().split("\n"):
-                section = line[:12].strip()
-                if not section == "":
-                    current_section = section
+            for line in data:
+                match = _SECTION_RX.match(line)
+                if match is not None:
+                    current_section, content = match.groups()
 
                     # Identifies the reaction equation and
                     # extracts the reactants and products.
                     if current_section == "EQUATION":
-                        equation = line[12:]
+                        equation = content
                         components = equation.split(" <=> ") 
                         reactants_temp = components[0].split(" + ")
                         reactants = []
@@ -111,11 +293,11 @@ def reaction_details(reaction):
                     # Identifies enzymes that catalyse the
                     # reaction and extracts their EC numbers.
                     if current_section == "ENZYME":
-                        if " " in line[12:]:
-                            enzymes = line[12:].split(" ")
+                        if " " in content:
+                            enzymes = content.split(" ")
                             enzymes = ['EC:' + enzyme for enzyme in enzymes if enzyme != ""]
                         else:
-                            enzymes = ["EC:" + line[12:]]
+                            enzymes = ["EC:" + content]
 
             return enzymes, reactants, products
 
@@ -123,23 +305,29 @@ def reaction_details(reaction):
             return (None,)*3
             
 
+@_memoize(unavailable=None)
 def retrieve_encoders(enzyme):
     """
-    Finds the genes and organisms that encode an enzyme.
+    Finds the genes and organisms that encode an enzyme, 
+    mapping the code of each organism to its genes.
     """
     data = get_data(enzyme)
-    if data is not None:
-        encoders = []
-        current_section = None
-        for line in data.rstrip().split("\n"):
-            section = line[:12].strip()
-            if not section == "":
-                current_section = section
-                if current_section == "GENES":
-                    index = data.rstrip().split("\n").index(line)
-                    encoders.append(line[12:].split(": "))
-                    for line in data.rstrip().split("\n")[int(index)+1:]:
-                        if line[:12].strip() != "":
-                            break
-                        encoders.append(line[12:].split(": "))
-        return encoders
\ No newline at end of file
+    if data is None:
+        raise _EntryUnavailable
+    encoders = {}
+    current_section = None
+    for line in data:
+        match = _SECTION_RX.match(line)
+        if match is not None:
+            # If the GENES section has been read
+            # then the processing ends.
+            if current_section == "GENES":
+                break
+            current_section, content = match.groups()
+        else:
+            content = line[12:]
+        if current_section == "GENES":
+            organism, separator, genes = content.partition(": ")
+            if separator:
+                encoders[organism] = genes
+    return encoders
\ No newline at end of file
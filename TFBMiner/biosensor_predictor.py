@@ -6,11 +6,24 @@ from itertools import chain
 import multiprocessing
 import concurrent.futures
 import typing as typ
+import re
+import os
 
 import numpy as np
 import pandas as pd
 
 
+# Matches the annotations of transcriptional regulators.
+_REG_RX = re.compile(r"regulator|repressor|activator")
+# Matches the accession number of a genome assembly in the filename of a 
+# feature table genome, without its GCA/GCF prefix.
+_ASSEMBLY_RX = re.compile(r"GC[AF](_\d+\.\d+)")
+# The genome assembly of each organism and the feature table genome of each
+# genome assembly, as set by set_genome_index.
+_assemblies = {}
+_genome_files = {}
+
+
 class Biosensor(typ.NamedTuple):
     """
     Stores biosensors and their relevant attributes in named tuples.
@@ -24,24 +37,71 @@ class Biosensor(typ.NamedTuple):
     gene_positions: dict
 
 
-def select_genome(organism_code, genome_assemblies, genome_files):
+class Genome(typ.NamedTuple):
+    """
+    Stores a feature table genome along with lookups of the positions,
+    strands and sequence types of its features, and of which features
+    are annotated as transcriptional regulators.
+    """
+    features: pd.DataFrame
+    locus_positions: dict
+    strands: np.ndarray
+    seq_types: np.ndarray
+    regulators: np.ndarray
+
+
+def index_genomes(genome_assemblies, genome_files):
+    """
+    Maps organism codes to their genome assemblies, and genome assemblies to 
+    the feature table genomes that have the assembly in their filename.
+    """
+    assemblies = {}
+    for organism_code, assembly in zip(genome_assemblies["Organism code"], genome_assemblies["Assembly"]):
+        if isinstance(assembly, str):
+            assemblies.setdefault(organism_code, assembly[3:])
+    genome_files_ = {}
+    for genome_file in genome_files:
+        match = _ASSEMBLY_RX.search(os.path.basename(genome_file))
+        if match is not None:
+            genome_files_.setdefault(match.group(1), genome_file)
+    
+    return assemblies, genome_files_
+
+
+def set_genome_index(assemblies, genome_files):
+    """
+    Sets the mappings used by select_genome. Also serves as a process pool
+    initializer so that each worker process receives them only once, rather
+    than with every task.
+    """
+    global _assemblies, _genome_files
+    _assemblies, _genome_files = assemblies, genome_files
+
+
+def select_genome(organism_code):
     """
     Identifies and returns an organism's GenBank genome assembly.
     """
-    # Finds the relevant genome assembly for an organism.
-    index = genome_assemblies.index[genome_assemblies["Organism code"] == str(organism_code).lower()]
-    if not index.empty:
-        assembly = genome_assemblies["Assembly"][index].to_string(index=False, header=False)
-        # Finds the feature table genome that has 
-        # the relevant genome assembly in its filename.
-        match = [s for s in genome_files if assembly[3:] in s]
-        if match != []:
+    # Finds the relevant genome assembly for an organism, and the feature 
+    # table genome that has the genome assembly in its filename.
+    assembly = _assemblies.get(str(organism_code).lower())
+    if assembly is not None:
+        genome_file = _genome_files.get(assembly)
+        if genome_file is not None:
             # Reads and parses the correct feature table genome.
-            genome = pd.read_csv(match[0], sep="\t")
+            genome = pd.read_csv(genome_file, sep="\t")
             genome.drop(genome[genome["# feature"] == "gene"].index, inplace=True)
             genome = genome.reset_index(drop=True)
+            # Maps each locus tag to the position of its first feature so
+            # that genes can be located without scanning the genome.
+            locus_tags = genome["locus_tag"][~genome["locus_tag"].duplicated()]
+            locus_positions = dict(zip(locus_tags, locus_tags.index))
+
+            # Regulators are identified once per genome rather than once per operon.
+            # Names are read as floats when a genome has none, so they are cast to strings.
+            regulators = genome["name"].fillna("").astype(str).str.contains(_REG_RX).to_numpy()
 
-            return genome
+            return Genome(genome, locus_positions, genome["strand"].to_numpy(), genome["seq_type"].to_numpy(), regulators)
 
 
 def identify_regulator(genome, operon, operon_orientation, gene_positions):
@@ -54,24 +114,24 @@ def identify_regulator(genome, operon, operon_orientation, gene_positions):
     try:
         # Selects regulators situated on the reverse DNA strand
         # that are upstream of an operon on the forward DNA strand.
+        # The genome is filtered with a single combined mask.
+        features = genome.features
         if operon_orientation == "+":
             start_position = min(positions)
-            start_seqtype = genome["seq_type"][start_position]
-            regulators = genome[genome["name"].str.contains("regulator|repressor|activator") == True]
-            regulators = regulators[regulators["strand"] == "-"]
-            regulators = regulators[regulators["seq_type"] == start_seqtype]
-            reg_positions = regulators.index.to_list()
-            reg_positions = [reg_position for reg_position in reg_positions if reg_position <= start_position]
+            start_seqtype = genome.seq_types[start_position]
+            mask = genome.regulators & (genome.strands == "-") & (genome.seq_types == start_seqtype)
+            regulators = features.loc[mask, ["locus_tag", "name"]]
+            reg_positions = regulators.index.to_numpy()
+            reg_positions = reg_positions[reg_positions <= start_position]
         # Selects regulators situated on the forward DNA strand
         # that are upstream of an operon on the reverse DNA strand.
         elif operon_orientation == "-":
             start_position = max(positions)
-            start_seqtype = genome["seq_type"][start_position]
-            regulators = genome[genome["name"].str.contains("regulator|repressor|activator") == True]
-            regulators = regulators[regulators["strand"] == "+"]
-            regulators = regulators[regulators["seq_type"] == start_seqtype]
-            reg_positions = regulators.index.to_list()
-            reg_positions = [reg_position for reg_position in reg_positions if reg_position >= start_position]
+            start_seqtype = genome.seq_types[start_position]
+            mask = genome.regulators & (genome.strands == "+") & (genome.seq_types == start_seqtype)
+            regulators = features.loc[mask, ["locus_tag", "name"]]
+            reg_positions = regulators.index.to_numpy()
+            reg_positions = reg_positions[reg_positions >= start_position]
         else:
             reg_positions = None
             
@@ -99,22 +159,16 @@ def identify_regulator(genome, operon, operon_orientation, gene_positions):
                 pass
             # Scores closest regulators that are situated on the forward
             # DNA strand and do not directly neighbour the operon.
+            # 2 points are deducted for each gene in between that is on the
+            # opposite DNA strand to the operon, and 1 point for the others.
             elif regulator_position > start_position:
-                for n in range(1, min_distance):
-                    orient = genome["strand"][start_position + n]
-                    if orient != operon_orientation:
-                        score -= 2
-                    else:
-                        score -= 1
+                intervening_strands = genome.strands[start_position+1:regulator_position]
+                score -= 2*len(intervening_strands) - int(np.count_nonzero(intervening_strands == operon_orientation))
             # Scores closest regulators that are situated on the reverse
             # DNA strand and do not directly neighbour the operon.
             elif regulator_position < start_position:
-                for n in range(1, min_distance):
-                    orient = genome["strand"][regulator_position + n]
-                    if orient != operon_orientation:
-                        score -= 2
-                    else:
-                        score -= 1
+                intervening_strands = genome.strands[regulator_position+1:start_position]
+                score -= 2*len(intervening_strands) - int(np.count_nonzero(intervening_strands == operon_orientation))
             else:
                 score = None
         
@@ -126,7 +180,7 @@ def identify_regulator(genome, operon, operon_orientation, gene_positions):
         return (None,)*3
 
 
-def predict_biosensors(df, genome_assemblies, genome_files, single_gene_operons=False):
+def predict_biosensors(df, single_gene_operons=False):
     """
     Applies a regulon identification algorithm to each row of a dataframe 
     wherein each row contains a complete set of genes that encode an enzymatic 
@@ -142,7 +196,7 @@ def predict_biosensors(df, genome_assemblies, genome_files, single_gene_operons=
         regulator that could be a biosensor for the compound that the operon metabolizes.
         """
         organism_code = row[0]
-        genome = select_genome(organism_code, genome_assemblies, genome_files)
+        genome = select_genome(organism_code)
 
         if genome is not None:
             num_cols = len(columns)
@@ -158,31 +212,37 @@ def predict_biosensors(df, genome_assemblies, genome_files, single_gene_operons=
             starting_genes = starting_genes.split(" ")
             all_genes = [row[n].split(" ") for n in range(1, num_cols)]
             all_genes = list(chain(*all_genes))
-            avoid_repeats = []
+            # Determines the index position of every gene once per row, rather 
+            # than once per starting gene. Genes absent from the genome have none.
+            all_positions = [genome.locus_positions.get(gene.split("(")[0]) for gene in all_genes]
+            avoid_repeats = set()
 
             for x in range(len(starting_genes)):
                 starting_gene = starting_genes[x]
-                starting_gene_ = starting_gene.split("(")[0]
                 operon = [starting_gene]
-                avoid_repeats.append(x)
+                avoid_repeats.add(x)
                 try:
-                    # Determines the index position and strand orientation of the starting gene.
-                    starting_position = genome.index[genome["locus_tag"] == starting_gene_].tolist()[0]
-                    starting_orientation = genome["strand"][starting_position]
-                    # Determines the index position and strand orientation of all other genes.
+                    # Determines the index position and strand orientation of the starting gene,
+                    # which is also the first of all genes as they begin with the starting genes.
+                    starting_position = all_positions[x]
+                    if starting_position is None:
+                        raise KeyError(starting_gene)
+                    starting_orientation = genome.strands[starting_position]
+                    # Determines the strand orientation of all other genes.
                     for y in range(len(all_genes)):
                         if y not in avoid_repeats:
                             gene = all_genes[y]
-                            gene_ = gene.split("(")[0]
-                            position = genome.index[genome["locus_tag"] == gene_].tolist()[0]
-                            gene_orientation = genome["strand"][position]
+                            position = all_positions[y]
+                            if position is None:
+                                raise KeyError(gene)
+                            gene_orientation = genome.strands[position]
                             try:
                                 # Genes that are nearby the starting gene and have 
                                 # the same strand orientation are placed in the operon.
                                 if (abs(int(starting_position) - int(position)) < 30) and (starting_orientation == gene_orientation):
                                     operon.append(gene)
                                     if y <= len(starting_genes)-1:
-                                        avoid_repeats.append(y)
+                                        avoid_repeats.add(y)
                                     if gene not in gene_positions:
                                         gene_positions[gene] = position
                             except ValueError:
@@ -197,7 +257,7 @@ def predict_biosensors(df, genome_assemblies, genome_files, single_gene_operons=
                         if None not in [regulator, score, annotation]:
                             biosensor = Biosensor(operon, regulator, score, annotation, organism_code, genes_, gene_positions)
                             biosensors.append(biosensor)
-                except IndexError:
+                except KeyError:
                     pass
 
     def identify_single_gene_regulons(row):
@@ -206,36 +266,42 @@ def predict_biosensors(df, genome_assemblies, genome_files, single_gene_operons=
         transcriptional regulators to predict potential biosensors.
         """
         organism_code = row[0]
-        genome = select_genome(organism_code, genome_assemblies, genome_files)
+        genome = select_genome(organism_code)
         if genome is not None:
             genes = row[1].split(" ")
             for gene in genes:
                 gene = gene.split("(")[0]
                 operon = [gene]
                 try:
-                    gene_position = genome.index[genome["locus_tag"] == gene].tolist()[0]
+                    gene_position = genome.locus_positions[gene]
                     gene_positions = {gene: gene_position}
-                    gene_orientation = genome["strand"][gene_position]
+                    gene_orientation = genome.strands[gene_position]
                     regulator, score, annotation = identify_regulator(genome, operon, gene_orientation, gene_positions)
                     if None not in [regulator, score, annotation]:
                         biosensor = Biosensor(operon, regulator, score, annotation, organism_code, {1: gene}, gene_positions)
                         biosensors.append(biosensor)
-                except IndexError:
+                except KeyError:
                     pass
 
+    # Rows are iterated as plain tuples, which avoids 
+    # constructing a Series for each row.
+    columns = df.columns.tolist()
     if single_gene_operons==False:
-        df.apply(lambda x: identify_regulons(x, df.columns), axis=1)
+        for row in df.itertuples(index=False, name=None):
+            identify_regulons(row, columns)
 
     elif single_gene_operons==True:
-        df.apply(lambda x: identify_single_gene_regulons(x), axis=1)
+        for row in df.itertuples(index=False, name=None):
+            identify_single_gene_regulons(row)
 
     return biosensors
 
 
-def execute_biosensor_predictions(df, genome_assemblies, genome_files, single_gene_operons=False):
+def execute_biosensor_predictions(df, genome_index, single_gene_operons=False):
     """
     Optimizes the execution of the biosensor prediction functions
-    based upon the size of the dataframe.
+    based upon the size of the dataframe. The genome index is the 
+    pair of mappings returned by index_genomes.
     """
     # Determines whether the data is large enough for multiprocessing 
     # and calculates the number of processes to conduct.
@@ -250,12 +316,16 @@ def execute_biosensor_predictions(df, genome_assemblies, genome_files, single_ge
     
     # Splits the data and conducts multiple processes.
     if processes is not None:
-        with concurrent.futures.ProcessPoolExecutor() as executor:
-            futures = [executor.submit(predict_biosensors, data, genome_assemblies, genome_files, single_gene_operons=single_gene_operons) for data in np.array_split(df, processes)]            
-            results = [future.result() for future in futures]
-            biosensors = [inner for outer in results for inner in outer]
+        with concurrent.futures.ProcessPoolExecutor(initializer=set_genome_index, initargs=genome_index) as executor:
+            futures = [executor.submit(predict_biosensors, data, single_gene_operons=single_gene_operons) for data in np.array_split(df, processes)]            
+            biosensors = []
+            # Results are collected in the order that the data was split, so 
+            # that biosensors with equal scores are always output in the same order.
+            for future in futures:
+                biosensors.extend(future.result())
     # Otherwise sequentially processes the data  
     else: 
-        biosensors = predict_biosensors(df, genome_assemblies, genome_files)
+        set_genome_index(*genome_index)
+        biosensors = predict_biosensors(df, single_gene_operons=single_gene_operons)
 
     return biosensors
\ No newline at end of file
@@ -2,16 +2,37 @@
 Conducts the chain identification stage of the pipeline.
 """
 
-from itertools import chain
 import concurrent.futures
 import multiprocessing
 import sys
 
-import numpy as np
-
 from TFBMiner import acquire_data
 
 
+# The number of reactions each process must have for multiprocessing to be used, 
+# below which starting and feeding the processes costs more than it saves.
+_MIN_REACTIONS_PER_PROCESS = 8
+
+
+def _worker_options(processes):
+    """
+    Returns the options for retrieving KEGG database entries within worker processes,
+    dividing the retrieval threads between the processes so that they do not 
+    multiply the number of concurrent requests to KEGG's RESTful API.
+    """
+    options = acquire_data.get_options()
+    options["fetch_threads"] = max(1, options["fetch_threads"] // processes)
+    return options
+
+
+def _split_evenly(items, n):
+    """
+    Splits a list into n contiguous sublists whose lengths differ by at most one.
+    """
+    k, m = divmod(len(items), n)
+    return [items[i*k+min(i, m):(i+1)*k+min(i+1, m)] for i in range(n)]
+
+
 class MetabolizerIdentifier:
     
     def __init__(self, inducer):
@@ -21,8 +42,6 @@ class MetabolizerIdentifier:
         """
         Generates linear chains of enzymes that sequentially catabolize an inducer compound.
         """
-        products_info = {}
-        reactions_info = {}
         all_chains = []
         # The IDs of unnecessary byproducts, such as H20 and NADH.
         excluded_compounds = [
@@ -32,71 +51,55 @@ class MetabolizerIdentifier:
         "C00011", "C00012", "C00013", "C00014", "C00019"
         ]
 
-        def link_reactions(reaction, compound, recursion_depth=0, limit=max_chain_length, prior_chains=None, prior_enzymes=None):
-            """
-            Uses recursion to identify whether a reaction catabolizes a product of a reaction that 
-            preceded it. Enzymes that catalyse these reactions are individually linked to generate 
-            linear enzymatic chains. This process continues until chains meet the maximum chain length.
-            """
-            # Retrieves and/or stores the details of a 
-            # reaction that a compound is involved in.
-            if reaction not in reactions_info:
+        # Reactions are explored breadth-first, one depth at a time, to identify whether
+        # a reaction catabolizes a product of a reaction that preceded it. Each reaction is
+        # processed once per depth for each compound, together with every chain that reached
+        # it, so that converging and cyclic routes through the reaction network are not
+        # traversed repeatedly. Enzymes that catalyse these reactions are individually linked
+        # to generate linear enzymatic chains until chains meet the maximum chain length.
+        frontier = {(reaction, self.inducer): dict.fromkeys([()]) for reaction in reactions}
+        # Enzymes of each reaction that have complete EC numbers, 
+        # as reactions recur across compounds and depths.
+        clean_enzymes = {}
+        for depth in range(max_chain_length):
+            # Concurrently retrieves the details of the reactions at the current depth.
+            acquire_data.prefetch(acquire_data.reaction_details, [reaction for reaction, compound in frontier])
+            linked_reactions = []
+            for (reaction, compound), prior_chains in frontier.items():
                 enzymes, reactants, products = acquire_data.reaction_details(reaction)
-                reaction_info = [enzymes, reactants, products]
-                reactions_info[reaction] = reaction_info
-            else:
-                reaction_info = reactions_info[reaction]
-                enzymes = reaction_info[0]
-                reactants = reaction_info[1]
-                products = reaction_info[2]
-
-            if None not in reaction_info:
-                starting_compound = compound
                 # Reactions that catabolize the compound are processed.
-                if starting_compound in reactants:
-                    # Creates enzymatic chains by linking enzymes that catalyse the
-                    # reaction at the current depth to enzymes from the previous depth. 
-                    if (recursion_depth == 1) and (prior_enzymes is not None):
-                        chains_ = [[enzyme_1, enzyme_2]
-                                    for enzyme_1 in prior_enzymes
-                                    if '-' not in enzyme_1
-                                    for enzyme_2 in enzymes
-                                    if '-' not in enzyme_2] 
-                    # Extends enzymatic chains from the previous depth.
-                    elif (recursion_depth > 1) and (prior_chains is not None):
-                        extended_chains = [chain + [e] for e in enzymes for chain in prior_chains if '-' not in e]
-                        chains_ = extended_chains
-                    else:
-                        chains_ = None
-                    
-                    # Chains at the current depth are output to terminal.
-                    if chains_ is not None:
-                        for chain_ in chains_:
-                            all_chains.append(chain_)
-                            print(f"Chain identified: {' => '.join(e for e in chain_)} ")
-                    
-                    # Retrieves and/or stores the subsequent reactions 
-                    # that each product is involved in.
-                    for product in products:
-                        if product not in excluded_compounds:
-                            if product not in products_info:
-                                reactions_2 = acquire_data.identify_reactions(product)
-                                products_info[product] = reactions_2
-                            else:
-                                reactions_2 = products_info[product]
-
-                            # Recursively either forms or extends chains based upon recursion depth.
-                            if len(reactions_2) < 100:
-                                for reaction_2 in reactions_2:
-                                    depth = recursion_depth
-                                    depth +=1
-                                    if depth == 1:
-                                        link_reactions(reaction_2, product, recursion_depth=depth, prior_enzymes=enzymes)
-                                    elif (depth > 1) and (depth < limit):
-                                        link_reactions(reaction_2, product, recursion_depth=depth, prior_chains=chains_)
-
-        for reaction in reactions:
-            link_reactions(reaction, self.inducer)
+                if (None in (enzymes, reactants, products)) or (compound not in reactants):
+                    continue
+                if reaction not in clean_enzymes:
+                    clean_enzymes[reaction] = [enzyme for enzyme in enzymes if '-' not in enzyme]
+                # Creates or extends enzymatic chains by linking enzymes that catalyse 
+                # the reaction at the current depth to chains from the previous depth.
+                chains_ = [prior_chain + (enzyme,) 
+                            for enzyme in clean_enzymes[reaction] 
+                            for prior_chain in prior_chains]
+                # Chains at the current depth are output to terminal.
+                if depth > 0:
+                    for chain_ in chains_:
+                        all_chains.append(list(chain_))
+                        print(f"Chain identified: {' => '.join(e for e in chain_)} ")
+                # Chains can only be extended further if any were formed.
+                if len(chains_) > 0:
+                    products_ = [product for product in products if product not in excluded_compounds]
+                    linked_reactions.append((chains_, products_))
+
+            if depth+1 == max_chain_length:
+                break
+            # Concurrently retrieves the subsequent reactions that each product is involved 
+            # in, and queues them for the next depth along with the chains that reached them.
+            acquire_data.prefetch(acquire_data.identify_reactions, 
+                [product for chains_, products_ in linked_reactions for product in products_])
+            frontier = {}
+            for chains_, products_ in linked_reactions:
+                for product in products_:
+                    reactions_2 = acquire_data.identify_reactions(product)
+                    if len(reactions_2) < 100:
+                        for reaction_2 in reactions_2:
+                            frontier.setdefault((reaction_2, product), {}).update(dict.fromkeys(chains_))
 
         return all_chains
 
@@ -105,40 +108,49 @@ class MetabolizerIdentifier:
         Conducts and optimizes the chain identification procedure 
         by using multiprocessing if appropriate.
         """
-        print("{}Identifying enzymatic chains for {} with maximum chain length set to {}...{}".format("\n", self.inducer, max_chain_length, "\n"))
+        print(f"\nIdentifying enzymatic chains for {self.inducer} with maximum chain length set to {max_chain_length}...\n")
         reactions = acquire_data.identify_reactions(self.inducer)
         total_reactions = len(reactions)
         cores = multiprocessing.cpu_count()
 
-        processes = cores if total_reactions>=cores else 2 if total_reactions>=2 else 1 if total_reactions==1 else None
-        if processes is not None:
+        processes = min(cores, total_reactions // _MIN_REACTIONS_PER_PROCESS)
+        if total_reactions > 0:
             if processes >= 2:
                 # Identifies enzymatic chains concurrently.
-                reactions = np.array(reactions, dtype=object)
-                with concurrent.futures.ProcessPoolExecutor() as executor:
+                with concurrent.futures.ProcessPoolExecutor(max_workers=processes, initializer=acquire_data.set_options, initargs=(_worker_options(processes),)) as executor:
                     futures = []
-                    for data in np.array_split(reactions, processes):
+                    for data in _split_evenly(reactions, processes):
                         future = executor.submit(self.identify_chains, data, max_chain_length)
                         futures.append(future)
                     
                     chains = []
-                    for future in futures:
+                    # Chains are deduplicated by their enzymes, 
+                    # which are hashed as tuples.
+                    seen = set()
+                    # Results are collected as each process completes, so 
+                    # that the slowest process does not hold up the others.
+                    for future in concurrent.futures.as_completed(futures):
                         result = future.result()
                         for chain in result:
-                            if chain not in chains:
+                            key = tuple(chain)
+                            if key not in seen:
+                                seen.add(key)
                                 chains.append(chain)
             else:
                 chains = []
+                seen = set()
                 chains_unfiltered = self.identify_chains(reactions, max_chain_length)
                 for chain in chains_unfiltered:
-                    if chain not in chains:
+                    key = tuple(chain)
+                    if key not in seen:
+                        seen.add(key)
                         chains.append(chain)
         else:
             chains = []
         
         total_chains = len(chains)
         if total_chains > 0:
-            print("{}{} unique chains were identified.".format("\n", total_chains))
+            print(f"\n{total_chains} unique chains were identified.")
             return chains, total_chains
         else:
             sys.exit(f"No chains were identified for {self.inducer}")
@@ -163,30 +175,33 @@ class MetabolizerIdentifier:
         Conducts and optimizes the single enzyme metabolizer 
         identification procedure by using multiprocessing if appropriate.
         """
-        print("{}Identifying single enzymes that metabolize {}...{}".format('\n', self.inducer, '\n'))
+        print(f"\nIdentifying single enzymes that metabolize {self.inducer}...\n")
         reactions = acquire_data.identify_reactions(self.inducer)
         total_reactions = len(reactions)
         cores = multiprocessing.cpu_count()
         
-        processes = cores if total_reactions>=cores else 2 if total_reactions>=2 else 1 if total_reactions==1 else None
-        if processes is not None:
+        processes = min(cores, total_reactions // _MIN_REACTIONS_PER_PROCESS)
+        if total_reactions > 0:
             if processes >= 2:
                 # Identifies single enzyme metabolizers concurrently.
-                reactions = np.array(reactions, dtype=object)
-                with concurrent.futures.ProcessPoolExecutor() as executor:
-                    futures = [executor.submit(self.identify_single_metabolizers, data) for data in np.array_split(reactions, processes)]            
+                with concurrent.futures.ProcessPoolExecutor(max_workers=processes, initializer=acquire_data.set_options, initargs=(_worker_options(processes),)) as executor:
+                    futures = [executor.submit(self.identify_single_metabolizers, data) for data in _split_evenly(reactions, processes)]
+                    # Results are collected in the order that the reactions were split,
+                    # so that enzymes are identified in the same order on every run.
                     enzymes = [future.result() for future in futures]
-            elif processes == 1:
-                enzymes = self.identify_single_metabolizers(reactions[0])
+            else:
+                enzymes = [self.identify_single_metabolizers(reactions)]
         else:
             enzymes = []
 
-        # Removes repeated enzymes.
-        enzymes = list(chain(*enzymes))
-        enzymes = list(dict.fromkeys(enzymes))
+        # Removes repeated enzymes in a single pass, keeping 
+        # the order in which they were identified.
+        seen = set()
+        enzymes = [enzyme for enzymes_ in enzymes for enzyme in enzymes_ 
+                    if not (enzyme in seen or seen.add(enzyme))]
         total_enzymes = len(enzymes)
         if total_enzymes > 0:
-            print("{}{} unique enzymes were identified as metabolizers of {}.".format('\n', total_enzymes, self.inducer))
+            print(f"\n{total_enzymes} unique enzymes were identified as metabolizers of {self.inducer}.")
             return enzymes, total_enzymes
         else:
             sys.exit(f"No chains were identified for {self.inducer}")
@@ -11,7 +11,7 @@ def argument_parser():
     """
     parser = argparse.ArgumentParser(
         prog="TFBMiner",
-        usage="py -m TFBMiner [-h] [-l L] [-s S] [-g G] [-o O] compound",
+        usage="py -m TFBMiner [-h] [-l L] [-s S] [-g G] [-o O] [-r R] [-t T] [-f F] compound",
         description = "TFBMiner: Identifies putative transcription factor-based biosensors for a given compound."
     )
     parser.add_argument(
@@ -47,6 +47,28 @@ def argument_parser():
         help="Enter the absolute path of the desired output directory. If unspecified, TFBMiner will output the results to the user's home directory.",
         default="unspecified"
     )
+    parser.add_argument(
+        "-r",
+        "--refresh_cache",
+        type=str,
+        help="Choose whether to ignore KEGG database entries cached by previous runs and retrieve them again (y/n).",
+        default="n"
+    )
+    parser.add_argument(
+        "-t",
+        "--kegg_timeout",
+        type=float,
+        help="Enter the number of seconds to wait for a response from KEGG's RESTful API before a retrieval is retried.",
+        default=30
+    )
+    parser.add_argument(
+        "-f",
+        "--output_format",
+        type=str,
+        choices=["csv", "feather", "parquet"],
+        help="Choose the file format of the output predictions (csv/feather/parquet). Feather and parquet require pyarrow to be installed.",
+        default="csv"
+    )
 
     args = parser.parse_args()
     return args
\ No newline at end of file
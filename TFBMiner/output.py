@@ -2,60 +2,100 @@
 Formats and outputs the biosensor prediction data.
 """
 
+from operator import attrgetter
 import os
 import re
 import csv
 
+import pandas as pd
 
-def output_predictions(biosensors, inducer, df_cols, output_path):
+# Output files are written through a 1 MiB buffer so
+# each file reaches the disk in few write calls.
+_WRITE_BUFFER_SIZE = 1 << 20
+# Matches column names up to the last digit of their EC number.
+_EC_TAIL_RE = re.compile(r".+([0-9])[^0-9]*$")
+
+def _write_predictions(header, columns, path, output_format):
+    """
+    Writes formatted prediction data, given as its header and 
+    columns, to a file of the given format.
+    """
+    if output_format == "csv":
+        # Rows are written straight from the columns by csv.writer, 
+        # so that lines end with \r\n on every platform.
+        with open(path, "w", buffering=_WRITE_BUFFER_SIZE, encoding="UTF8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            writer.writerows(zip(*columns))
+    else:
+        # Columns are keyed by position as chains may repeat an enzyme.
+        data = pd.DataFrame(dict(enumerate(columns)))
+        data.columns = header
+        with open(path, "wb", buffering=_WRITE_BUFFER_SIZE) as f:
+            if output_format == "feather":
+                data.to_feather(f)
+            else:
+                data.to_parquet(f, compression="zstd", compression_level=1)
+
+
+def format_predictions(biosensors, inducer, df_cols, output_format="csv"):
     """
-    Formats the predicted biosensors data to be output
-    as .csv files in specific directories.
+    Formats the predicted biosensors data to be output as .csv, .feather 
+    or .parquet files in specific directories. Returns the directory and 
+    filename that the data will be output to, within the results directory 
+    of the inducer, and the data itself as its header and columns.
     """
-    biosensors.sort(key=lambda x: x.regulator_score, reverse=True)
+    biosensors.sort(key=attrgetter("regulator_score"), reverse=True)
     num_cols = len(df_cols)
 
-    # Prepares directory names for specific output data.
-    dir_1 = inducer + "_results"
+    # Prepares the name of the directory for specific output data, 
+    # within the results directory of the inducer.
     if num_cols > 2:
-        dir_2 = "chainlength=" + str(num_cols-1)
+        subdir = f"chainlength={num_cols-1}"
     else:
-        dir_2 = "single-enzyme_predictions"
+        subdir = "single-enzyme_predictions"
 
-    # Prepares name for .csv file that will hold predictions
+    # Prepares name for the file that will hold predictions
     # for a specific enzymatic chain.
     enzyme_colnames = df_cols[1:]
-    last_ec_num_idxs = [colname.rfind(re.match('.+([0-9])[^0-9]*$', colname).group(1)) for colname in enzyme_colnames]    
-    filename = inducer + "(" + "-".join("ec" + colname[3:last_ec_num_idxs[enzyme_colnames.index(colname)]+1] for colname in enzyme_colnames) + ").csv"
+    last_ec_num_idxs = [_EC_TAIL_RE.match(colname).start(1) for colname in enzyme_colnames]
+    ec_nums = "-".join(f"ec{colname[3:idx+1]}" for colname, idx in zip(enzyme_colnames, last_ec_num_idxs))
+    filename = f"{inducer}({ec_nums}).{output_format}"
     
-    # Formats the data for .csv files.
+    # Formats the data column by column, reading
+    # the attributes of each biosensor only once.
     header = ["Organism_code"] + [df_cols[x] for x in range(1, num_cols)] + ["Operon", 
                 "Regulator", 
                 "Regulator_score", 
                 "Regulator_annotation"]
     
-    data = [[biosensor.organism_code] + 
-            [biosensor.genes[x] for x in range(1, num_cols)] +
-            [" ".join(str(gene) for gene in biosensor.operon),
-            biosensor.regulator,
-            biosensor.regulator_score,
-            biosensor.regulator_annotation] 
-            for biosensor in biosensors]
+    get_attributes = attrgetter("organism_code", "genes", "operon", "regulator", "regulator_score", "regulator_annotation")
+    organism_codes, genes, operons, regulators, scores, annotations = zip(*map(get_attributes, biosensors))
+    columns = ([organism_codes] + 
+            [[genes_[x] for genes_ in genes] for x in range(1, num_cols)] +
+            [[" ".join(str(gene) for gene in operon) for operon in operons],
+            regulators,
+            scores,
+            annotations])
+    # Columns are given unique names in every format, as feather and parquet 
+    # require them, so repeated enzymes are suffixed the way pandas.read_csv 
+    # would name them.
+    counts = {}
+    for i, colname in enumerate(header):
+        counts[colname] = counts.get(colname, 0) + 1
+        if counts[colname] > 1:
+            header[i] = f"{colname}.{counts[colname]-1}"
     
-    # Creates directories and outputs
-    # data as .csv files within them.
-    try:
-        path = os.path.join(output_path, dir_1, dir_2, filename)
-        with open(path, "w", encoding="UTF8", newline="") as f:
-            writer = csv.writer(f)
-            writer.writerow(header)
-            writer.writerows(data)
-            
-    except FileNotFoundError:
-        dirs = os.path.join(output_path, dir_1, dir_2)
-        os.makedirs(dirs)
-        path = os.path.join(output_path, dir_1, dir_2, filename)
-        with open(path, "w", encoding="UTF8", newline="") as f:
-            writer = csv.writer(f)
-            writer.writerow(header)
-            writer.writerows(data)
\ No newline at end of file
+    return (subdir, filename), (header, columns)
+
+
+def output_predictions(biosensors, inducer, df_cols, results_path, output_format="csv"):
+    """
+    Formats and outputs the predicted biosensors data to a file within 
+    the results directory of the inducer, as soon as they are predicted.
+    """
+    (subdir, filename), (header, columns) = format_predictions(biosensors, inducer, df_cols, output_format)
+    dirs = os.path.join(results_path, subdir)
+    os.makedirs(dirs, exist_ok=True)
+    path = os.path.join(dirs, filename)
+    _write_predictions(header, columns, path, output_format)
\ No newline at end of file
@@ -3,71 +3,93 @@ Contains functions for applying the biosensor prediction algorithms on
 identified enzymatic chains.
 """
 
+import concurrent.futures
+import multiprocessing
 import time
+import os
 
 import pandas as pd
 from tqdm import tqdm
 
 from TFBMiner import acquire_data, output, biosensor_predictor, identify_metabolizers
 
+
+# The number of seconds allowed for retrieving the encoders of a chain's enzymes.
+# Chains whose encoders cannot be retrieved in time are skipped.
+_CHAIN_RETRIEVAL_TIME_LIMIT = 300
+
+
+def process_enzyme(enzyme, encoders, genome_index=None):
+    """
+    Predicts biosensors for the encoders of a single enzyme metabolizer, 
+    returning the biosensors and the columns of their data. Worker processes, 
+    whose genome index is set by their initializer, predict biosensors directly. 
+    Otherwise, predictions are shared between processes using the given 
+    genome index.
+    """
+    # A dataframe is only built for enzymes with encoders.
+    if encoders:
+        df_cols = ["Organism", f"{enzyme}_gene(s)"]
+        encoders_df = pd.DataFrame.from_records(list(encoders.items()), columns=df_cols)
+        if genome_index is None:
+            biosensors = biosensor_predictor.predict_biosensors(encoders_df, single_gene_operons=True)
+        else:
+            biosensors = biosensor_predictor.execute_biosensor_predictions(encoders_df, genome_index, single_gene_operons=True)
+        return biosensors, df_cols
+    return [], None
+
+
 class MetabolizerProcessor:
-    def __init__(self, inducer, genome_assemblies, genome_files, t1, output_path, metabolizers, total_metabolizers):
+    def __init__(self, inducer, genome_assemblies, genome_files, t1, output_path, metabolizers, total_metabolizers, output_format="csv"):
         self.inducer = inducer
-        self.genome_assemblies = genome_assemblies
-        self.genome_files = genome_files
+        # Genome lookups are prepared once for all biosensor predictions.
+        self.genome_index = biosensor_predictor.index_genomes(genome_assemblies, genome_files)
         self.t1 = t1
         self.output_path = output_path
+        # The results directory of the inducer, within which predictions are output.
+        self.results_path = os.path.join(output_path, f"{inducer}_results")
         self.metabolizers = metabolizers
         self.total_metabolizers = total_metabolizers
+        self.output_format = output_format
 
     def process_chains(self):
         """
         Iterates through a collection of enzymatic chains and processes 
         them to predict potential biosesors for the compound they metabolize.
         """
-        print("{}Processing {} chains...{}".format("\n", self.total_metabolizers, "\n"))
+        print(f"\nProcessing {self.total_metabolizers} chains...\n")
         total_biosensors = 0
         for n in tqdm(range(self.total_metabolizers)):
             #num_biosensors = self.process_chain(self.metabolizers[n])
-            all_genes = {}
             chain = self.metabolizers[n]
-            for n in range(len(chain)):
-                enzyme = chain[n].lower()
-                encoders = acquire_data.retrieve_encoders(enzyme)
-                if encoders is not None:
-                    # Organisms and their genes are stored in a dataframe.
-                    all_genes["d" + str(n)] = pd.DataFrame(encoders, 
-                    columns=["Organism", str(enzyme) + "_gene(s)"])
-            
-            num_sets = len(all_genes)
-            if num_sets > 1:    
-                try:
-                    # Merges the dataframes to form one that only includes 
-                    # organisms that possess all enzymes within the chain.
-                    for x in range(num_sets-1):
-                        all_genes["d" + str(x+1)] = pd.merge(
-                        left = all_genes["d" + str(x)], 
-                        right = all_genes["d" + str(int(x)+1)], 
-                        left_on = "Organism", 
-                        right_on = "Organism")
-
-                    filtered_encoders_df = all_genes["d" + str(max(range(num_sets)))] 
-                    if (not filtered_encoders_df.empty) and (len(filtered_encoders_df.columns) > 2):
-                        df_cols = filtered_encoders_df.columns.values.tolist()
-                        biosensors = biosensor_predictor.execute_biosensor_predictions(filtered_encoders_df, self.genome_assemblies, self.genome_files)
-                        # If biosensors were predicted, they are ranked in order
-                        # of their scores and formatted for data output.
-                        num_biosensors = len(biosensors)
-                        if num_biosensors > 0:
-                            output.output_predictions(biosensors, self.inducer, df_cols, self.output_path)
-                            total_biosensors+=num_biosensors
-                except KeyError:
-                    pass
+            enzymes = [enzyme.lower() for enzyme in chain]
+            # Retrieves the encoders of every enzyme within the chain concurrently.
+            acquire_data.set_deadline(_CHAIN_RETRIEVAL_TIME_LIMIT)
+            all_encoders = acquire_data.prefetch(acquire_data.retrieve_encoders, enzymes)
+            acquire_data.set_deadline(None)
+            if (len(chain) > 1) and (None not in all_encoders):
+                # Finds the organisms that possess all enzymes within the chain.
+                organisms = set(all_encoders[0]).intersection(*all_encoders[1:])
+                if len(organisms) > 0:
+                    # Organisms and their genes are stored in a dataframe,
+                    # in the order that KEGG lists the organisms.
+                    df_cols = ["Organism"] + [f"{enzyme}_gene(s)" for enzyme in enzymes]
+                    filtered_encoders_df = pd.DataFrame(
+                        [[organism] + [encoders[organism] for encoders in all_encoders] 
+                        for organism in all_encoders[0] if organism in organisms], 
+                        columns=df_cols)
+                    biosensors = biosensor_predictor.execute_biosensor_predictions(filtered_encoders_df, self.genome_index)
+                    # If biosensors were predicted, they are ranked in order
+                    # of their scores and formatted for data output.
+                    num_biosensors = len(biosensors)
+                    if num_biosensors > 0:
+                        output.output_predictions(biosensors, self.inducer, df_cols, self.results_path, self.output_format)
+                        total_biosensors+=num_biosensors
         t2 = time.time()
         if total_biosensors > 0:
-            print("{}Processing is complete. {} potential biosensors were identified for {}. Results have been deposited to {}. Total runtime: {}s.".format("\n", total_biosensors, self.inducer, self.output_path, round(t2-self.t1, 2)))
+            print(f"\nProcessing is complete. {total_biosensors} potential biosensors were identified for {self.inducer}. Results have been deposited to {self.output_path}. Total runtime: {round(t2-self.t1, 2)}s.")
         else:
-            print("{}Processing is complete. {} potential biosensors were identified for {}. Total runtime: {}s".format("\n", total_biosensors, self.inducer, round(t2-self.t1, 2)))
+            print(f"\nProcessing is complete. {total_biosensors} potential biosensors were identified for {self.inducer}. Total runtime: {round(t2-self.t1, 2)}s")
             alt = input("Would you like to predict biosensors for potential single-gene operons, instead? Predictions are more likely to be made, but at expense of lower prediction accuracy. (y/n)")
             if alt == "y":
                 self.t1 = time.time()
@@ -81,23 +103,36 @@ class MetabolizerProcessor:
         Iterates through a collection of single enzyme metabolizers and processes 
         them to predict potential biosesors for the compound they metabolize.
         """
-        print("{}Processing {} enzymes...{}".format("\n", self.total_metabolizers, "\n"))
+        print(f"\nProcessing {self.total_metabolizers} enzymes...\n")
         total_biosensors = 0
-        for n in tqdm(range(self.total_metabolizers)):
-            enzyme = self.metabolizers[n].lower()
-            encoders = acquire_data.retrieve_encoders(enzyme)
-            if encoders is not None:
-                encoders_df = pd.DataFrame(encoders, 
-                columns=["Organism", str(enzyme) + "_gene(s)"])
-                if (not encoders_df.empty) and (len(encoders_df.columns) > 1):
-                    df_cols = encoders_df.columns.values.tolist()
-                    biosensors = biosensor_predictor.execute_biosensor_predictions(encoders_df, self.genome_assemblies, self.genome_files, single_gene_operons=True)
-                    num_biosensors = len(biosensors)
-                    if num_biosensors > 0:
-                        total_biosensors += num_biosensors
-                        output.output_predictions(biosensors, self.inducer, df_cols, self.output_path)
+        enzymes = [enzyme.lower() for enzyme in self.metabolizers]
+        # Retrieves the encoders of every enzyme concurrently before 
+        # biosensors are predicted, so that predictions do not wait on KEGG.
+        print("Retrieving the genes that encode each enzyme...")
+        all_encoders = acquire_data.prefetch(acquire_data.retrieve_encoders, enzymes, progress=True)
+        print("Predicting biosensors...")
+        cores = multiprocessing.cpu_count()
+        if self.total_metabolizers >= cores:
+            # Enzymes are processed concurrently, each within a single process.
+            executor = concurrent.futures.ProcessPoolExecutor(initializer=biosensor_predictor.set_genome_index, initargs=self.genome_index)
+            results = executor.map(process_enzyme, enzymes, all_encoders, chunksize=max(1, self.total_metabolizers // (cores*4)))
+        else:
+            # There are too few enzymes to share between processes, 
+            # so the organisms of each enzyme are shared instead.
+            executor = None
+            results = (process_enzyme(enzyme, encoders, self.genome_index) for enzyme, encoders in zip(enzymes, all_encoders))
+        try:
+            for biosensors, df_cols in tqdm(results, total=self.total_metabolizers):
+                num_biosensors = len(biosensors)
+                if num_biosensors > 0:
+                    total_biosensors += num_biosensors
+                    output.output_predictions(biosensors, self.inducer, df_cols, self.results_path, self.output_format)
+        finally:
+            # The pool is shut down even if processing fails.
+            if executor is not None:
+                executor.shutdown()
         t2 = time.time()
         if total_biosensors > 0:
-            print("{}Processing is complete. {} potential biosensors were identified for {}. Results have been deposited to {}. Total runtime: {}s.".format("\n", total_biosensors, self.inducer, self.output_path, round(t2-self.t1, 2)))
+            print(f"\nProcessing is complete. {total_biosensors} potential biosensors were identified for {self.inducer}. Results have been deposited to {self.output_path}. Total runtime: {round(t2-self.t1, 2)}s.")
         else:
-            print("{}Processing is complete. {} potential biosensors were identified for {}. Total runtime: {}s".format("\n", total_biosensors, self.inducer, round(t2-self.t1, 2)))
\ No newline at end of file
+            print(f"\nProcessing is complete. {total_biosensors} potential biosensors were identified for {self.inducer}. Total runtime: {round(t2-self.t1, 2)}s")
\ No newline at end of file